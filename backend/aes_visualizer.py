@@ -2,224 +2,236 @@
 AES Visualization Module - Simulates AES encryption/decryption step-by-step
 """
 import base64
-from typing import List, Dict, Any
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
 
 # AES S-Box (SubBytes lookup table)
-S_BOX = [
-    0x63, 0x7c, 0x77, 0x7b, 0xf2, 0x6b, 0x6f, 0xc5, 0x30, 0x01, 0x67, 0x2b, 0xfe, 0xd7, 0xab, 0x76,
-    0xca, 0x82, 0xc9, 0x7d, 0xfa, 0x59, 0x47, 0xf0, 0xad, 0xd4, 0xa2, 0xaf, 0x9c, 0xa4, 0x72, 0xc0,
-    0xb7, 0xfd, 0x93, 0x26, 0x36, 0x3f, 0xf7, 0xcc, 0x34, 0xa5, 0xe5, 0xf1, 0x71, 0xd8, 0x31, 0x15,
-    0x04, 0xc7, 0x23, 0xc3, 0x18, 0x96, 0x05, 0x9a, 0x07, 0x12, 0x80, 0xe2, 0xeb, 0x27, 0xb2, 0x75,
-    0x09, 0x83, 0x2c, 0x1a, 0x1b, 0x6e, 0x5a, 0xa0, 0x52, 0x3b, 0xd6, 0xb3, 0x29, 0xe3, 0x2f, 0x84,
-    0x53, 0xd1, 0x00, 0xed, 0x20, 0xfc, 0xb1, 0x5b, 0x6a, 0xcb, 0xbe, 0x39, 0x4a, 0x4c, 0x58, 0xcf,
-    0xd0, 0xef, 0xaa, 0xfb, 0x43, 0x4d, 0x33, 0x85, 0x45, 0xf9, 0x02, 0x7f, 0x50, 0x3c, 0x9f, 0xa8,
-    0x51, 0xa3, 0x40, 0x8f, 0x92, 0x9d, 0x38, 0xf5, 0xbc, 0xb6, 0xda, 0x21, 0x10, 0xff, 0xf3, 0xd2,
-    0xcd, 0x0c, 0x13, 0xec, 0x5f, 0x97, 0x44, 0x17, 0xc4, 0xa7, 0x7e, 0x3d, 0x64, 0x5d, 0x19, 0x73,
-    0x60, 0x81, 0x4f, 0xdc, 0x22, 0x2a, 0x90, 0x88, 0x46, 0xee, 0xb8, 0x14, 0xde, 0x5e, 0x0b, 0xdb,
-    0xe0, 0x32, 0x3a, 0x0a, 0x49, 0x06, 0x24, 0x5c, 0xc2, 0xd3, 0xac, 0x62, 0x91, 0x95, 0xe4, 0x79,
-    0xe7, 0xc8, 0x37, 0x6d, 0x8d, 0xd5, 0x4e, 0xa9, 0x6c, 0x56, 0xf4, 0xea, 0x65, 0x7a, 0xae, 0x08,
-    0xba, 0x78, 0x25, 0x2e, 0x1c, 0xa6, 0xb4, 0xc6, 0xe8, 0xdd, 0x74, 0x1f, 0x4b, 0xbd, 0x8b, 0x8a,
-    0x70, 0x3e, 0xb5, 0x66, 0x48, 0x03, 0xf6, 0x0e, 0x61, 0x35, 0x57, 0xb9, 0x86, 0xc1, 0x1d, 0x9e,
-    0xe1, 0xf8, 0x98, 0x11, 0x69, 0xd9, 0x8e, 0x94, 0x9b, 0x1e, 0x87, 0xe9, 0xce, 0x55, 0x28, 0xdf,
-    0x8c, 0xa1, 0x89, 0x0d, 0xbf, 0xe6, 0x42, 0x68, 0x41, 0x99, 0x2d, 0x0f, 0xb0, 0x54, 0xbb, 0x16
-]
-
-def bytes_to_matrix(block: bytes) -> List[List[int]]:
+S_BOX = bytes.fromhex(
+    "637c777bf26b6fc53001672bfed7ab76"
+    "ca82c97dfa5947f0add4a2af9ca472c0"
+    "b7fd9326363ff7cc34a5e5f171d83115"
+    "04c723c31896059a071280e2eb27b275"
+    "09832c1a1b6e5aa0523bd6b329e32f84"
+    "53d100ed20fcb15b6acbbe394a4c58cf"
+    "d0efaafb434d338545f9027f503c9fa8"
+    "51a3408f929d38f5bcb6da2110fff3d2"
+    "cd0c13ec5f974417c4a77e3d645d1973"
+    "60814fdc222a908846eeb814de5e0bdb"
+    "e0323a0a4906245cc2d3ac629195e479"
+    "e7c8376d8dd54ea96c56f4ea657aae08"
+    "ba78252e1ca6b4c6e8dd741f4bbd8b8a"
+    "703eb5664803f60e613557b986c11d9e"
+    "e1f8981169d98e949b1e87e9ce5528df"
+    "8ca1890dbfe6426841992d0fb054bb16"
+)
+
+# Round constants for the key schedule
+RCON = (0x01, 0x02, 0x04, 0x08, 0x10, 0x20, 0x40, 0x80, 0x1b, 0x36)
+
+# NumPy view of the S-Box so SubBytes is a single fancy-indexing call
+S_BOX_NP = np.frombuffer(S_BOX, dtype=np.uint8)
+
+# Hex strings for every byte value, so formatting a state never calls hex()
+HEX_TABLE = np.array([f"0x{i:02x}" for i in range(256)], dtype=object)
+
+# ShiftRows as a gather: row r of the result takes columns (c + r) % 4
+SHIFT_ROWS_ROWS = np.arange(4).reshape(4, 1)
+SHIFT_ROWS_COLS = (np.arange(4).reshape(1, 4) + SHIFT_ROWS_ROWS) % 4
+
+# Row gathers for MixColumns: ROT_k[r] is row (r + k) % 4
+ROT_1 = np.array([1, 2, 3, 0])
+ROT_2 = np.array([2, 3, 0, 1])
+ROT_3 = np.array([3, 0, 1, 2])
+
+# xtime lookup table - multiplication by x (i.e. {02}) in GF(2^8)
+XTIME = np.array([((i << 1) ^ (0x1b if i & 0x80 else 0)) & 0xff for i in range(256)], dtype=np.uint8)
+
+def bytes_to_matrix(block: bytes) -> np.ndarray:
     """Convert 16 bytes to 4x4 matrix (column-major order)"""
-    matrix = [[0 for _ in range(4)] for _ in range(4)]
-    for i in range(16):
-        matrix[i % 4][i // 4] = block[i]
-    return matrix
+    # Read-only view over the input buffer - the transforms below never write in place
+    return np.frombuffer(block, dtype=np.uint8, count=16).reshape(4, 4).T
 
-def matrix_to_bytes(matrix: List[List[int]]) -> bytes:
+def bytes_to_states(data: bytes) -> np.ndarray:
+    """Convert a multiple of 16 bytes to a stack of 4x4 matrices, one per block"""
+    if len(data) % 16:
+        raise ValueError("Data length must be a multiple of 16 bytes")
+    return np.frombuffer(data, dtype=np.uint8).reshape(-1, 4, 4).transpose(0, 2, 1)
+
+def matrix_to_bytes(matrix: np.ndarray) -> bytes:
     """Convert 4x4 matrix to 16 bytes"""
-    block = bytearray(16)
-    for i in range(16):
-        block[i] = matrix[i % 4][i // 4]
-    return bytes(block)
+    return matrix.tobytes(order='F')
 
-def sub_bytes(matrix: List[List[int]]) -> List[List[int]]:
+def sub_bytes(matrix: np.ndarray) -> np.ndarray:
     """SubBytes transformation - replace each byte using S-Box"""
-    new_matrix = [[0 for _ in range(4)] for _ in range(4)]
-    for i in range(4):
-        for j in range(4):
-            new_matrix[i][j] = S_BOX[matrix[i][j]]
-    return new_matrix
-
-def shift_rows(matrix: List[List[int]]) -> List[List[int]]:
-    """ShiftRows transformation - shift rows cyclically"""
-    new_matrix = [row[:] for row in matrix]
-    # Row 0: no shift
-    # Row 1: shift left by 1
-    new_matrix[1] = [new_matrix[1][1], new_matrix[1][2], new_matrix[1][3], new_matrix[1][0]]
-    # Row 2: shift left by 2
-    new_matrix[2] = [new_matrix[2][2], new_matrix[2][3], new_matrix[2][0], new_matrix[2][1]]
-    # Row 3: shift left by 3
-    new_matrix[3] = [new_matrix[3][3], new_matrix[3][0], new_matrix[3][1], new_matrix[3][2]]
-    return new_matrix
-
-def mix_columns(matrix: List[List[int]]) -> List[List[int]]:
-    """MixColumns transformation - mix columns (simplified for visualization)"""
-    # Simplified MixColumns - for visualization, we'll show a conceptual transformation
-    # In real AES, this uses Galois field multiplication
-    new_matrix = [[0 for _ in range(4)] for _ in range(4)]
-    for c in range(4):
-        # Simplified: mix each column
-        for r in range(4):
-            new_matrix[r][c] = (matrix[r][c] ^ matrix[(r+1)%4][c] ^ 
-                               matrix[(r+2)%4][c] ^ matrix[(r+3)%4][c]) % 256
-    return new_matrix
-
-def add_round_key(matrix: List[List[int]], key_matrix: List[List[int]]) -> List[List[int]]:
+    return S_BOX_NP[matrix]
+
+def shift_rows(matrix: np.ndarray) -> np.ndarray:
+    """ShiftRows transformation - shift row r cyclically left by r"""
+    return matrix[..., SHIFT_ROWS_ROWS, SHIFT_ROWS_COLS]
+
+def sub_shift(matrix: np.ndarray) -> np.ndarray:
+    """SubBytes and ShiftRows fused - gather each byte from its shifted source and substitute it"""
+    # Both steps act byte by byte, so the order does not matter and no intermediate state is built
+    return S_BOX_NP[matrix[..., SHIFT_ROWS_ROWS, SHIFT_ROWS_COLS]]
+
+def mix_columns(matrix: np.ndarray) -> np.ndarray:
+    """MixColumns transformation - multiply each column by the fixed polynomial in GF(2^8)"""
+    # Row r of the result is {02}*a[r] ^ {03}*a[r+1] ^ a[r+2] ^ a[r+3];
+    # xtime is linear over XOR, so {02}*a[r] ^ {02}*a[r+1] is one lookup
+    a1 = matrix[..., ROT_1, :]
+    return XTIME[matrix ^ a1] ^ a1 ^ matrix[..., ROT_2, :] ^ matrix[..., ROT_3, :]
+
+def add_round_key(matrix: np.ndarray, key_matrix: np.ndarray) -> np.ndarray:
     """AddRoundKey transformation - XOR with round key"""
-    new_matrix = [[0 for _ in range(4)] for _ in range(4)]
-    for i in range(4):
-        for j in range(4):
-            new_matrix[i][j] = matrix[i][j] ^ key_matrix[i][j]
-    return new_matrix
-
-def expand_key(key: bytes, num_rounds: int) -> List[List[List[int]]]:
-    """Generate round keys (simplified for visualization)"""
-    round_keys = []
-    key_matrix = bytes_to_matrix(key)
-    
-    for round_num in range(num_rounds + 1):
-        # Simplified key expansion - for visualization
-        round_key = [[0 for _ in range(4)] for _ in range(4)]
-        for i in range(4):
-            for j in range(4):
-                round_key[i][j] = (key_matrix[i][j] + round_num * 16 + i * 4 + j) % 256
-        round_keys.append(round_key)
-    
-    return round_keys
-
-def visualize_aes_encryption(plaintext: str, key: bytes, key_size: int) -> List[Dict[str, Any]]:
-    """Simulate AES encryption step-by-step and return all intermediate states"""
+    return matrix ^ key_matrix
+
+def key_gen_assist(word: bytes, rcon: int) -> bytes:
+    """RotWord, SubWord and the round constant in one step (software AESKEYGENASSIST)"""
+    # SubWord is a single C-level translate over the 256-byte S-Box table
+    sub = (word[1:] + word[:1]).translate(S_BOX)
+    return bytes((sub[0] ^ rcon,)) + sub[1:]
+
+@lru_cache(maxsize=128)
+def expand_key(key: bytes) -> np.ndarray:
+    """Generate round keys with the Rijndael key schedule, as a (num_rounds + 1, 4, 4) array"""
+    nk = len(key) // 4
+    num_rounds = nk + 6
+    # The whole schedule as one flat buffer of 4-byte words
+    schedule = bytearray(key)
+    
+    for i in range(nk, 4 * (num_rounds + 1)):
+        temp = schedule[-4:]
+        if i % nk == 0:
+            temp = key_gen_assist(temp, RCON[i // nk - 1])
+        elif nk > 6 and i % nk == 4:
+            # AES-256 applies an extra SubWord halfway through each key block
+            temp = temp.translate(S_BOX)
+        prev = schedule[4 * (i - nk):4 * (i - nk) + 4]
+        schedule += (int.from_bytes(prev, 'big') ^ int.from_bytes(temp, 'big')).to_bytes(4, 'big')
+    
+    # Each round key is four consecutive words laid out as columns. The array is
+    # backed by immutable bytes, so it is read-only and safe to share from the cache
+    return np.frombuffer(bytes(schedule), dtype=np.uint8).reshape(num_rounds + 1, 4, 4).transpose(0, 2, 1)
+
+def state_hex(matrix: np.ndarray) -> List[List[str]]:
+    """Format a state matrix (or a stack of them) as hex strings via table lookup"""
+    return HEX_TABLE[matrix].tolist()
+
+def run_rounds(state: np.ndarray, round_keys: np.ndarray, num_rounds: int) -> np.ndarray:
+    """Run the cipher on one state and return the state after every step as a (steps, 4, 4) array"""
+    snapshots = np.empty((4 * num_rounds + 1, 4, 4), dtype=np.uint8)
+    snapshots[0] = state
+    
+    state = add_round_key(state, round_keys[0])
+    snapshots[1] = state
+    
+    i = 2
+    for round_num in range(1, num_rounds + 1):
+        state = sub_bytes(state)
+        snapshots[i] = state
+        state = shift_rows(state)
+        snapshots[i + 1] = state
+        i += 2
+        
+        # The final round has no MixColumns
+        if round_num != num_rounds:
+            state = mix_columns(state)
+            snapshots[i] = state
+            i += 1
+        
+        state = add_round_key(state, round_keys[round_num])
+        snapshots[i] = state
+        i += 1
+    
+    return snapshots
+
+def aes_round_trace(plain: bytes, key: bytes) -> np.ndarray:
+    """Encrypt 16-byte blocks (ECB) and return the state after every round as a (num_rounds + 1, len(plain)) array"""
+    round_keys = expand_key(key)
+    num_rounds = len(round_keys) - 1
+    trace = np.empty((num_rounds + 1, len(plain)), dtype=np.uint8)
+    
+    # All blocks are transformed together, one vectorized call per step
+    state = add_round_key(bytes_to_states(plain), round_keys[0])
+    trace[0] = state.transpose(0, 2, 1).ravel()
+    
+    for round_num in range(1, num_rounds + 1):
+        state = sub_shift(state)
+        if round_num != num_rounds:
+            state = mix_columns(state)
+        state = add_round_key(state, round_keys[round_num])
+        # Rows of the trace are the blocks back to back, each in column-major byte order
+        trace[round_num] = state.transpose(0, 2, 1).ravel()
+    
+    return trace
+
+def prepare_block(plaintext: str) -> bytes:
+    """First 16 bytes of the UTF-8 plaintext, zero-padded to a full block"""
+    return plaintext.encode('utf-8')[:16].ljust(16, b'\0')
+
+def snapshot_round_trace(snapshots: np.ndarray, num_rounds: int) -> List[str]:
+    """Hex block after each AddRoundKey in a run_rounds snapshot stack (entry 0 is the initial AddRoundKey)"""
+    # AddRoundKey lands on snapshot 1, every 4th one after it, and the last one (no MixColumns)
+    ark = snapshots[np.r_[1:4 * num_rounds:4, 4 * num_rounds]]
+    return [matrix_to_bytes(state).hex() for state in ark]
+
+def visualize_aes_encryption(plaintext: str, key: bytes, key_size: int,
+                             include_trace: bool = False) -> Tuple[List[Dict[str, Any]], Optional[List[str]]]:
+    """Simulate AES encryption step-by-step and return all intermediate states, plus the per-round trace if requested"""
     steps = []
     
+    def add_step(operation: str, description: str, color: str, state: List[List[str]], **extra: Any) -> None:
+        steps.append({
+            "step": len(steps),
+            "operation": operation,
+            "description": description,
+            "state": state,
+            "color": color,
+            **extra
+        })
+    
     # Determine number of rounds
     num_rounds = {128: 10, 192: 12, 256: 14}[key_size]
     
     # Prepare input (first 16 bytes of plaintext, padded if needed)
-    plaintext_bytes = plaintext.encode('utf-8')[:16]
-    if len(plaintext_bytes) < 16:
-        plaintext_bytes = plaintext_bytes.ljust(16, b'\0')
+    plaintext_bytes = prepare_block(plaintext)
     
     # Convert to matrix
     state = bytes_to_matrix(plaintext_bytes)
     
     # Generate round keys
-    round_keys = expand_key(key, num_rounds)
+    round_keys = expand_key(key)
+    
+    # Run every transformation up front, then format all snapshots in one lookup
+    snapshots = run_rounds(state, round_keys, num_rounds)
+    states = iter(state_hex(snapshots))
     
     # Step 0: Initial state
-    steps.append({
-        "step": 0,
-        "operation": "Initial State",
-        "description": "Plaintext block converted to 4x4 state matrix",
-        "state": [[hex(b) for b in row] for row in state],
-        "color": "gray"
-    })
+    add_step("Initial State", "Plaintext block converted to 4x4 state matrix", "gray", next(states))
     
     # Initial Round: AddRoundKey
-    state = add_round_key(state, round_keys[0])
-    steps.append({
-        "step": 1,
-        "operation": "AddRoundKey (Initial)",
-        "description": "XOR state with initial round key (Key Schedule Round 0)",
-        "state": [[hex(b) for b in row] for row in state],
-        "color": "red"
-    })
-    
-    # Rounds 1 to (num_rounds - 1)
-    for round_num in range(1, num_rounds):
-        # SubBytes
-        state = sub_bytes(state)
-        steps.append({
-            "step": len(steps),
-            "operation": f"SubBytes (Round {round_num})",
-            "description": "Each byte is replaced using S-Box lookup table",
-            "state": [[hex(b) for b in row] for row in state],
-            "color": "blue",
-            "round": round_num
-        })
-        
-        # ShiftRows
-        state = shift_rows(state)
-        steps.append({
-            "step": len(steps),
-            "operation": f"ShiftRows (Round {round_num})",
-            "description": "Each row is cyclically shifted to the left",
-            "state": [[hex(b) for b in row] for row in state],
-            "color": "purple",
-            "round": round_num
-        })
-        
-        # MixColumns
-        state = mix_columns(state)
-        steps.append({
-            "step": len(steps),
-            "operation": f"MixColumns (Round {round_num})",
-            "description": "Columns are mixed using Galois field multiplication",
-            "state": [[hex(b) for b in row] for row in state],
-            "color": "green",
-            "round": round_num
-        })
-        
-        # AddRoundKey
-        state = add_round_key(state, round_keys[round_num])
-        steps.append({
-            "step": len(steps),
-            "operation": f"AddRoundKey (Round {round_num})",
-            "description": "XOR state with round key",
-            "state": [[hex(b) for b in row] for row in state],
-            "color": "red",
-            "round": round_num
-        })
+    add_step("AddRoundKey (Initial)", "XOR state with initial round key (Key Schedule Round 0)", "red", next(states))
     
-    # Final Round (no MixColumns)
-    # SubBytes
-    state = sub_bytes(state)
-    steps.append({
-        "step": len(steps),
-        "operation": f"SubBytes (Final Round)",
-        "description": "Each byte is replaced using S-Box lookup table",
-        "state": [[hex(b) for b in row] for row in state],
-        "color": "blue",
-        "round": num_rounds
-    })
-    
-    # ShiftRows
-    state = shift_rows(state)
-    steps.append({
-        "step": len(steps),
-        "operation": f"ShiftRows (Final Round)",
-        "description": "Each row is cyclically shifted to the left",
-        "state": [[hex(b) for b in row] for row in state],
-        "color": "purple",
-        "round": num_rounds
-    })
-    
-    # AddRoundKey
-    state = add_round_key(state, round_keys[num_rounds])
-    steps.append({
-        "step": len(steps),
-        "operation": f"AddRoundKey (Final Round)",
-        "description": "XOR state with final round key",
-        "state": [[hex(b) for b in row] for row in state],
-        "color": "red",
-        "round": num_rounds
-    })
+    # Rounds 1 to num_rounds (the final round has no MixColumns)
+    for round_num in range(1, num_rounds + 1):
+        final = round_num == num_rounds
+        label = "Final Round" if final else f"Round {round_num}"
+        
+        add_step(f"SubBytes ({label})", "Each byte is replaced using S-Box lookup table", "blue",
+                 next(states), round=round_num)
+        add_step(f"ShiftRows ({label})", "Each row is cyclically shifted to the left", "purple",
+                 next(states), round=round_num)
+        if not final:
+            add_step(f"MixColumns ({label})", "Columns are mixed using Galois field multiplication", "green",
+                     next(states), round=round_num)
+        add_step(f"AddRoundKey ({label})",
+                 "XOR state with final round key" if final else "XOR state with round key",
+                 "red", next(states), round=round_num)
     
     # Final ciphertext
-    ciphertext_bytes = matrix_to_bytes(state)
-    steps.append({
-        "step": len(steps),
-        "operation": "Ciphertext",
-        "description": "Final encrypted block (16 bytes)",
-        "state": [[hex(b) for b in row] for row in state],
-        "ciphertext_hex": ciphertext_bytes.hex(),
-        "color": "cyan"
-    })
-    
-    return steps
-
+    add_step("Ciphertext", "Final encrypted block (16 bytes)", "cyan", steps[-1]["state"],
+             ciphertext_hex=matrix_to_bytes(snapshots[-1]).hex())
+    
+    return steps, snapshot_round_trace(snapshots, num_rounds) if include_trace else None
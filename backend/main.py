@@ -1,18 +1,27 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import padding
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 import os
 import base64
+import pybase64
 import time
-from typing import Optional, List, Dict, Any
+from functools import lru_cache
+from typing import Optional, List, Dict, Any, Tuple, Callable, Union
 from aes_visualizer import visualize_aes_encryption
 
 app = FastAPI(title="AES Encryption/Decryption API")
 
+# OpenSSL backend - fetched once instead of on every request
+BACKEND = default_backend()
+
+HEX_CHARS = frozenset("0123456789abcdefABCDEF")
+
+# Upper bound on cached key objects. Cached keys stay in process memory until evicted.
+KEY_CACHE_SIZE = 256
+
 # Enable CORS
 # In production, update allow_origins with your frontend URL
 FRONTEND_URL = os.environ.get("FRONTEND_URL", "*")
@@ -22,6 +31,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Let browsers read the IV and timing returned by the raw endpoints
+    expose_headers=["X-AES-IV", "X-Execution-Time-Ms"],
 )
 
 class EncryptionRequest(BaseModel):
@@ -50,10 +61,17 @@ class DecryptionResponse(BaseModel):
     key_size: int
     mode: str
 
+@lru_cache(maxsize=1024)
 def decode_key(key: str, key_size: int) -> bytes:
-    """Decode key from base64 or hex string"""
+    """Decode key from base64 or hex string (cached, so repeated keys skip parsing)"""
+    # Hex keys of the right length never decode to the right size as base64,
+    # so check them first and avoid a raise/catch for the common case
+    if len(key) == key_size // 4 and HEX_CHARS.issuperset(key):
+        return bytes.fromhex(key)
+    
     try:
-        # Try base64 first
+        # Try base64 first. Stdlib base64 on purpose: it stops at mid-string '=' padding where
+        # pybase64 raises, and keys must keep deriving the same bytes as before
         decoded = base64.b64decode(key)
         if len(decoded) * 8 == key_size:
             return decoded
@@ -78,94 +96,127 @@ def decode_key(key: str, key_size: int) -> bytes:
     
     return key_bytes
 
-def pad_data(data: bytes) -> bytes:
-    """Pad data for block cipher"""
-    padder = padding.PKCS7(128).padder()
-    return padder.update(data) + padder.finalize()
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def get_aesgcm(key: bytes) -> AESGCM:
+    """Return a cached AESGCM instance for the key"""
+    return AESGCM(key)
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def get_aes(key: bytes) -> algorithms.AES:
+    """Return a cached AES algorithm object for the key (the IV varies, so Cipher is built per call)"""
+    return algorithms.AES(key)
+
+def pad_data(data: bytes) -> bytearray:
+    """Pad data for block cipher (PKCS7), written into a single buffer"""
+    pad = 16 - (len(data) & 15)
+    padded = bytearray(len(data) + pad)
+    padded[:len(data)] = data
+    padded[len(data):] = bytes((pad,)) * pad
+    return padded
+
+def encrypt_blocks(cipher: Cipher, padded_data: bytearray) -> memoryview:
+    """Encrypt block-aligned data in one update_into call"""
+    out = bytearray(len(padded_data) + 15)
+    n = cipher.encryptor().update_into(padded_data, out)
+    # No finalize() needed - the input is already padded, so CBC/ECB hold no trailing state
+    # Return a view instead of copying the output buffer into a new bytes object
+    return memoryview(out)[:n]
+
+def decrypt_blocks(cipher: Cipher, ciphertext: bytes) -> memoryview:
+    """Decrypt data in one update_into call into a preallocated buffer"""
+    out = bytearray(len(ciphertext) + 15)
+    decryptor = cipher.decryptor()
+    n = decryptor.update_into(ciphertext, out)
+    # finalize() rejects ciphertext that is not a whole number of blocks
+    decryptor.finalize()
+    return memoryview(out)[:n]
+
+def unpad_data(data: Union[bytes, memoryview]) -> bytes:
+    """Unpad data after decryption (PKCS7)"""
+    pad = data[-1] if data else 0
+    if not 1 <= pad <= 16 or data[-pad:] != bytes((pad,)) * pad:
+        raise ValueError("Invalid padding bytes.")
+    return bytes(data[:-pad])
+
+# Handler signatures: (key, plaintext) -> (ciphertext, IV) and (key, ciphertext, base64 IV) -> plaintext
+EncryptResult = Tuple[Union[bytes, memoryview], Optional[bytes]]
+Encryptor = Callable[[bytes, bytes], EncryptResult]
+Decryptor = Callable[[bytes, bytes, Optional[str]], bytes]
+
+def encrypt_gcm(key: bytes, plaintext_bytes: bytes) -> EncryptResult:
+    """AES-GCM encryption, returning the ciphertext and IV"""
+    iv = os.urandom(12)  # 96-bit IV for GCM
+    return get_aesgcm(key).encrypt(iv, plaintext_bytes, None), iv
+
+def encrypt_cbc(key: bytes, plaintext_bytes: bytes) -> EncryptResult:
+    """AES-CBC encryption, returning the ciphertext and IV"""
+    iv = os.urandom(16)  # 128-bit IV for CBC
+    cipher = Cipher(get_aes(key), modes.CBC(iv), backend=BACKEND)
+    return encrypt_blocks(cipher, pad_data(plaintext_bytes)), iv
+
+def encrypt_ecb(key: bytes, plaintext_bytes: bytes) -> EncryptResult:
+    """AES-ECB encryption (not recommended for production, but included for demo) - no IV"""
+    cipher = Cipher(get_aes(key), modes.ECB(), backend=BACKEND)
+    return encrypt_blocks(cipher, pad_data(plaintext_bytes)), None
 
-def unpad_data(data: bytes) -> bytes:
-    """Unpad data after decryption"""
-    unpadder = padding.PKCS7(128).unpadder()
-    return unpadder.update(data) + unpadder.finalize()
+def decrypt_gcm(key: bytes, ciphertext: bytes, iv: Optional[str]) -> bytes:
+    """AES-GCM decryption (IV base64 encoded)"""
+    if not iv:
+        raise HTTPException(status_code=400, detail="IV is required for GCM mode")
+    return get_aesgcm(key).decrypt(pybase64.b64decode(iv), ciphertext, None)
+
+def decrypt_cbc(key: bytes, ciphertext: bytes, iv: Optional[str]) -> bytes:
+    """AES-CBC decryption (IV base64 encoded)"""
+    if not iv:
+        raise HTTPException(status_code=400, detail="IV is required for CBC mode")
+    cipher = Cipher(get_aes(key), modes.CBC(pybase64.b64decode(iv)), backend=BACKEND)
+    return unpad_data(decrypt_blocks(cipher, ciphertext))
+
+def decrypt_ecb(key: bytes, ciphertext: bytes, iv: Optional[str]) -> bytes:
+    """AES-ECB decryption (the IV is ignored, not even decoded)"""
+    cipher = Cipher(get_aes(key), modes.ECB(), backend=BACKEND)
+    return unpad_data(decrypt_blocks(cipher, ciphertext))
+
+KEY_SIZES = (128, 192, 256)
+
+# Handlers per mode, so a request is dispatched with one lookup
+ENCRYPTORS: Dict[str, Encryptor] = {"CBC": encrypt_cbc, "GCM": encrypt_gcm, "ECB": encrypt_ecb}
+DECRYPTORS: Dict[str, Decryptor] = {"CBC": decrypt_cbc, "GCM": decrypt_gcm, "ECB": decrypt_ecb}
+
+def get_handler(handlers: Dict[str, Callable], key_size: int, mode: str) -> Callable:
+    """Look up the handler for a mode, rejecting unsupported key sizes and modes"""
+    if key_size not in KEY_SIZES:
+        raise HTTPException(status_code=400, detail="Key size must be 128, 192, or 256 bits")
+    handler = handlers.get(mode)
+    if handler is None:
+        raise HTTPException(status_code=400, detail="Mode must be CBC, GCM, or ECB")
+    return handler
 
 @app.post("/encrypt", response_model=EncryptionResponse)
 async def encrypt_data(request: EncryptionRequest):
     """Encrypt plaintext using AES"""
-    start_time = time.time()
+    start_time = time.perf_counter_ns()
     
     try:
-        # Validate key size
-        if request.key_size not in [128, 192, 256]:
-            raise HTTPException(status_code=400, detail="Key size must be 128, 192, or 256 bits")
-        
-        # Validate mode
-        if request.mode not in ["CBC", "GCM", "ECB"]:
-            raise HTTPException(status_code=400, detail="Mode must be CBC, GCM, or ECB")
+        encrypt = get_handler(ENCRYPTORS, request.key_size, request.mode)
         
         # Decode key
         key = decode_key(request.key, request.key_size)
         
-        plaintext_bytes = request.plaintext.encode('utf-8')
+        ciphertext, iv = encrypt(key, request.plaintext.encode('utf-8'))
         
-        if request.mode == "GCM":
-            # AES-GCM mode
-            iv = os.urandom(12)  # 96-bit IV for GCM
-            aesgcm = AESGCM(key)
-            ciphertext = aesgcm.encrypt(iv, plaintext_bytes, None)
-            iv_b64 = base64.b64encode(iv).decode('utf-8')
-            ciphertext_b64 = base64.b64encode(ciphertext).decode('utf-8')
-            
-            execution_time = (time.time() - start_time) * 1000
-            
-            return EncryptionResponse(
-                ciphertext=ciphertext_b64,
-                iv=iv_b64,
-                execution_time_ms=execution_time,
-                key_size=request.key_size,
-                mode=request.mode
-            )
+        iv_b64 = pybase64.b64encode_as_string(iv) if iv else None
+        ciphertext_b64 = pybase64.b64encode_as_string(ciphertext)
         
-        elif request.mode == "CBC":
-            # AES-CBC mode
-            iv = os.urandom(16)  # 128-bit IV for CBC
-            cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
-            encryptor = cipher.encryptor()
-            
-            padded_data = pad_data(plaintext_bytes)
-            ciphertext = encryptor.update(padded_data) + encryptor.finalize()
-            
-            iv_b64 = base64.b64encode(iv).decode('utf-8')
-            ciphertext_b64 = base64.b64encode(ciphertext).decode('utf-8')
-            
-            execution_time = (time.time() - start_time) * 1000
-            
-            return EncryptionResponse(
-                ciphertext=ciphertext_b64,
-                iv=iv_b64,
-                execution_time_ms=execution_time,
-                key_size=request.key_size,
-                mode=request.mode
-            )
+        execution_time = (time.perf_counter_ns() - start_time) / 1e6
         
-        else:  # ECB mode
-            # AES-ECB mode (not recommended for production, but included for demo)
-            cipher = Cipher(algorithms.AES(key), modes.ECB(), backend=default_backend())
-            encryptor = cipher.encryptor()
-            
-            padded_data = pad_data(plaintext_bytes)
-            ciphertext = encryptor.update(padded_data) + encryptor.finalize()
-            
-            ciphertext_b64 = base64.b64encode(ciphertext).decode('utf-8')
-            
-            execution_time = (time.time() - start_time) * 1000
-            
-            return EncryptionResponse(
-                ciphertext=ciphertext_b64,
-                iv=None,
-                execution_time_ms=execution_time,
-                key_size=request.key_size,
-                mode=request.mode
-            )
+        return EncryptionResponse(
+            ciphertext=ciphertext_b64,
+            iv=iv_b64,
+            execution_time_ms=execution_time,
+            key_size=request.key_size,
+            mode=request.mode
+        )
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Encryption error: {str(e)}")
@@ -173,56 +224,20 @@ async def encrypt_data(request: EncryptionRequest):
 @app.post("/decrypt", response_model=DecryptionResponse)
 async def decrypt_data(request: DecryptionRequest):
     """Decrypt ciphertext using AES"""
-    start_time = time.time()
+    start_time = time.perf_counter_ns()
     
     try:
-        # Validate key size
-        if request.key_size not in [128, 192, 256]:
-            raise HTTPException(status_code=400, detail="Key size must be 128, 192, or 256 bits")
-        
-        # Validate mode
-        if request.mode not in ["CBC", "GCM", "ECB"]:
-            raise HTTPException(status_code=400, detail="Mode must be CBC, GCM, or ECB")
+        decrypt = get_handler(DECRYPTORS, request.key_size, request.mode)
         
         # Decode key
         key = decode_key(request.key, request.key_size)
         
-        # Decode ciphertext
-        ciphertext = base64.b64decode(request.ciphertext)
+        # Decode ciphertext (the IV is decoded by the modes that use it)
+        ciphertext = pybase64.b64decode(request.ciphertext)
         
-        if request.mode == "GCM":
-            # AES-GCM mode
-            if not request.iv:
-                raise HTTPException(status_code=400, detail="IV is required for GCM mode")
-            
-            iv = base64.b64decode(request.iv)
-            aesgcm = AESGCM(key)
-            plaintext_bytes = aesgcm.decrypt(iv, ciphertext, None)
-            plaintext = plaintext_bytes.decode('utf-8')
+        plaintext = decrypt(key, ciphertext, request.iv).decode('utf-8')
         
-        elif request.mode == "CBC":
-            # AES-CBC mode
-            if not request.iv:
-                raise HTTPException(status_code=400, detail="IV is required for CBC mode")
-            
-            iv = base64.b64decode(request.iv)
-            cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
-            decryptor = cipher.decryptor()
-            
-            padded_plaintext = decryptor.update(ciphertext) + decryptor.finalize()
-            plaintext_bytes = unpad_data(padded_plaintext)
-            plaintext = plaintext_bytes.decode('utf-8')
-        
-        else:  # ECB mode
-            # AES-ECB mode
-            cipher = Cipher(algorithms.AES(key), modes.ECB(), backend=default_backend())
-            decryptor = cipher.decryptor()
-            
-            padded_plaintext = decryptor.update(ciphertext) + decryptor.finalize()
-            plaintext_bytes = unpad_data(padded_plaintext)
-            plaintext = plaintext_bytes.decode('utf-8')
-        
-        execution_time = (time.time() - start_time) * 1000
+        execution_time = (time.perf_counter_ns() - start_time) / 1e6
         
         return DecryptionResponse(
             plaintext=plaintext,
@@ -234,13 +249,67 @@ async def decrypt_data(request: DecryptionRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Decryption error: {str(e)}")
 
+@app.post("/encrypt_raw")
+async def encrypt_raw(
+    request: Request,
+    key: str = Header(..., alias="X-AES-Key"),
+    key_size: int = Header(128, alias="X-AES-Key-Size"),
+    mode: str = Header("CBC", alias="X-AES-Mode"),
+):
+    """Encrypt a binary request body using AES, returning raw ciphertext (no base64/JSON)"""
+    start_time = time.perf_counter_ns()
+    
+    try:
+        encrypt = get_handler(ENCRYPTORS, key_size, mode)
+        
+        ciphertext, iv = encrypt(decode_key(key, key_size), await request.body())
+        
+        execution_time = (time.perf_counter_ns() - start_time) / 1e6
+        
+        headers = {"X-Execution-Time-Ms": str(execution_time)}
+        if iv:
+            headers["X-AES-IV"] = pybase64.b64encode_as_string(iv)
+        
+        # CBC/ECB ciphertext is a memoryview over the update_into buffer. Older Starlette
+        # versions allowed by fastapi>=0.104.1 only accept bytes/str, so copy the memoryview once.
+        return Response(bytes(ciphertext), media_type="application/octet-stream", headers=headers)
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Encryption error: {str(e)}")
+
+@app.post("/decrypt_raw")
+async def decrypt_raw(
+    request: Request,
+    key: str = Header(..., alias="X-AES-Key"),
+    key_size: int = Header(128, alias="X-AES-Key-Size"),
+    mode: str = Header("CBC", alias="X-AES-Mode"),
+    iv: Optional[str] = Header(None, alias="X-AES-IV"),
+):
+    """Decrypt a binary request body using AES, returning raw plaintext bytes"""
+    start_time = time.perf_counter_ns()
+    
+    try:
+        decrypt = get_handler(DECRYPTORS, key_size, mode)
+        
+        plaintext_bytes = decrypt(decode_key(key, key_size), await request.body(), iv)
+        
+        execution_time = (time.perf_counter_ns() - start_time) / 1e6
+        
+        return Response(plaintext_bytes, media_type="application/octet-stream",
+                        headers={"X-Execution-Time-Ms": str(execution_time)})
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Decryption error: {str(e)}")
+
 class VisualizationRequest(BaseModel):
     plaintext: str = Field(..., description="Text to visualize encryption")
     key: str = Field(..., description="AES key (base64 encoded or hex)")
     key_size: int = Field(128, description="Key size in bits (128, 192, or 256)")
+    include_trace: bool = Field(False, description="Also return the block state after each round")
 
 class VisualizationResponse(BaseModel):
     steps: List[Dict[str, Any]]
+    round_trace: Optional[List[str]] = None
     total_rounds: int
     key_size: int
 
@@ -249,19 +318,21 @@ async def visualize_aes(request: VisualizationRequest):
     """Visualize AES encryption step-by-step"""
     try:
         # Validate key size
-        if request.key_size not in [128, 192, 256]:
+        if request.key_size not in KEY_SIZES:
             raise HTTPException(status_code=400, detail="Key size must be 128, 192, or 256 bits")
         
         # Decode key
         key = decode_key(request.key, request.key_size)
         
         # Generate visualization steps
-        steps = visualize_aes_encryption(request.plaintext, key, request.key_size)
+        steps, round_trace = visualize_aes_encryption(request.plaintext, key, request.key_size,
+                                                      include_trace=request.include_trace)
         
         num_rounds = {128: 10, 192: 12, 256: 14}[request.key_size]
         
         return VisualizationResponse(
             steps=steps,
+            round_trace=round_trace,
             total_rounds=num_rounds,
             key_size=request.key_size
         )
@@ -277,5 +348,8 @@ if __name__ == "__main__":
     import uvicorn
     import os
     port = int(os.environ.get("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # One worker per core; each process keeps its own key caches.
+    # The "auto" loop/http defaults pick uvloop and httptools when installed (uvicorn[standard])
+    workers = int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1))
+    uvicorn.run("main:app", host="0.0.0.0", port=port, workers=workers)
 